@@ -1,12 +1,13 @@
 """Base code shared by both server and client."""
-import copy
 from datetime import datetime, timezone
 from importlib.resources import files
 import json
 import logging
 import re
 import string
-from urllib.parse import urlencode, urljoin, urlparse
+import sys
+import threading
+from urllib.parse import urlencode, urljoin
 
 import grapheme
 from multiformats import CID
@@ -31,6 +32,8 @@ PARAMETER_TYPES = frozenset((
     'number',
     'string',
 ))
+# types allowed for a lexicon def
+DEF_TYPES = LEXICON_TYPES | PARAMETER_TYPES
 # https://atproto.com/specs/lexicon#overview-of-types
 FIELD_TYPES = {
     'null': type(None),
@@ -73,6 +76,8 @@ DOMAIN_PATTERN = r'([a-z0-9][a-z0-9-]{0,62}(?<!-)\.){1,}[a-z][a-z0-9-]*(?<!-)'
 DOMAIN_RE = re.compile(f'^{DOMAIN_PATTERN}$')
 
 # https://atproto.com/specs/nsid
+#
+# use these with fullmatch, not match! $ also matches before a trailing newline.
 NSID_SEGMENT = '[a-zA-Z0-9-]+'
 NSID_SEGMENT_RE = re.compile(f'^{NSID_SEGMENT}$')
 NSID_PATTERN = r'(?![0-9])((?!-)[a-z0-9-]{1,63}(?<!-)\.){2,}[a-zA-Z]{1,63}'
@@ -91,6 +96,16 @@ TID_RE = re.compile(rf'^[{BASE32_CHARS}]{{13}}$')
 
 CID_RE = re.compile(r'^[A-Za-z0-9+]{8,}$')
 
+# https://atproto.com/specs/lexicon#datetime
+# timezone is required, fractional seconds are optional. the first 19
+# characters, YYYY-MM-DDTHH:MM:SS, are then parsed with datetime.fromisoformat
+# to check ranges, eg month <= 12.
+DATETIME_RE = re.compile(r"""
+    [0-9]{4}-[0-9]{2}-[0-9]{2}T[0-9]{2}:[0-9]{2}:[0-9]{2}
+    (?:\.[0-9]+)?
+    (?:Z|[+-][0-9]{2}:[0-9]{2})
+    """, re.VERBOSE)
+
 # https://www.w3.org/TR/did-core/#did-syntax
 DID_PATTERN = r'did:[a-z]+:[A-Za-z0-9._%:-]{1,2048}(?<!:)'
 DID_RE = re.compile(f'^{DID_PATTERN}$')
@@ -106,6 +121,12 @@ AT_URI_RE = re.compile(rf"""
        (?:/(?P<rkey>[{_CHARS}:~_]+))?)?
     $""", re.VERBOSE)
 
+# https://atproto.com/specs/lexicon#uri
+# https://www.rfc-editor.org/rfc/rfc3986#section-3
+# scheme, then anything without whitespace, as long as it has at least one
+# non-empty authority, path, query, or fragment
+URI_RE = re.compile(r'[A-Za-z][A-Za-z0-9+.-]*:(?!(?://)?\??#?\Z)\S*')
+
 # wrapper for datetime.now, lets us mock it out in tests
 now = lambda tz=timezone.utc, **kwargs: datetime.now(tz=tz, **kwargs)
 
@@ -122,17 +143,74 @@ class XrpcError(ValueError):
         self.message = message
 
 
-def load_lexicons(traversable):
+def load_lexicons(traversable, lexicons=None):
+    """Loads lexicons from a JSON file or a directory of them, recursively.
+
+    Loads serially. A thread pool was slower here, since the work is mostly
+    JSON parsing, which holds the GIL.
+
+    Args:
+      traversable (importlib.resources.abc.Traversable): file or directory
+      lexicons (list of dict): optional, loaded lexicons are appended to this
+
+    Returns:
+      list of dict: lexicons
+    """
+    if lexicons is None:
+        lexicons = []
+
     if traversable.is_file():
-        lexicons = [json.loads(traversable.read_text())]
+        # json.loads detects UTF-8 itself, and skipping read_text avoids an
+        # extra decode and its dependence on the locale's default encoding
+        lexicons.append(json.loads(traversable.read_bytes()))
     elif traversable.is_dir():
-        lexicons = sum((load_lexicons(item) for item in traversable.iterdir()),
-                       start=[])
+        for item in traversable.iterdir():
+            load_lexicons(item, lexicons)
 
     return lexicons
 
-_bundled_lexicons = load_lexicons(files('lexrpc').joinpath('lexicons'))
-logger.info(f'{len(_bundled_lexicons)} lexicons loaded')
+# loaded lazily, on first use, in Base.__init__. _bundled_defs is the
+# corresponding Base.defs, which instances copy instead of rebuilding.
+_bundled_lexicons = None
+_bundled_defs = None
+
+
+def grapheme_length(val):
+    """Returns the number of graphemes in a string.
+
+    ASCII strings, the common case, skip the much slower grapheme cluster
+    segmentation. Each ASCII character is its own grapheme, except CRLF, which
+    is one grapheme: https://unicode.org/reports/tr29/#GB3
+
+    Args:
+      val (str)
+
+    Returns:
+      int:
+    """
+    if val.isascii():
+        return len(val) - val.count('\r\n')
+
+    return grapheme.length(val)
+
+
+def grapheme_slice(val, end):
+    """Returns the first ``end`` graphemes of a string.
+
+    Like :func:`grapheme_length`, ASCII strings skip grapheme cluster
+    segmentation, unless they contain CRLF.
+
+    Args:
+      val (str)
+      end (int)
+
+    Returns:
+      str:
+    """
+    if val.isascii() and '\r\n' not in val:
+        return val[:end]
+
+    return grapheme.slice(val, end=end)
 
 
 def fail(msg, exc=NotImplementedError):
@@ -146,12 +224,138 @@ class ValidationError(ValueError):
     pass
 
 
+def _decode_boolean_param(name, val):
+    if val == 'true':
+        return True
+    elif val == 'false':
+        return False
+
+    raise ValueError(
+        f'Got {val!r} for boolean parameter {name}, expected true or false')
+
+
+def _decode_integer_param(name, val):
+    try:
+        return int(val)
+    except ValueError as e:
+        e.args = [f'{e.args[0]} for integer parameter {name}']
+        raise e
+
+
+def _decode_number_param(name, val):
+    try:
+        return float(val)
+    except ValueError as e:
+        e.args = [f'{e.args[0]} for number parameter {name}']
+        raise e
+
+
+# maps parameter type to decoder function that takes (name, val) and returns
+# decoded value. strings pass through as is; array values are collected into
+# lists by decode_params.
+PARAM_DECODERS = {
+    'array': list,
+    'boolean': _decode_boolean_param,
+    'integer': _decode_integer_param,
+    'number': _decode_number_param,
+    'string': None,
+}
+
+
+def _is_at_identifier(val):
+    return DID_RE.fullmatch(val) or DOMAIN_RE.fullmatch(val.lower())
+
+
+def _is_at_uri(val):
+    return (len(val) < 8 * 1024
+            and AT_URI_RE.fullmatch(val)
+            and '/./' not in val
+            and '/../' not in val
+            and not val.endswith('/.')
+            and not val.endswith('/..'))
+
+
+def _is_cid(val):
+    # ideally I'd use CID.decode here, but it doesn't support CIDv5,
+    # it's too strict about padding, etc.
+    return CID_RE.fullmatch(val)
+
+
+def _is_datetime(val):
+    if not DATETIME_RE.fullmatch(val):
+        return False
+
+    try:
+        datetime.fromisoformat(val[:19])
+    except ValueError:
+        return False
+
+    return True
+
+
+def _is_did(val):
+    return DID_RE.fullmatch(val)
+
+
+def _is_nsid(val):
+    return len(val) <= 317 and NSID_RE.fullmatch(val) and '.' in val
+
+
+def _is_handle(val):
+    return len(val) <= 253 and DOMAIN_RE.fullmatch(val.lower())
+
+
+def _is_tid(val):
+    # high bit, big-endian, can't be 1
+    return TID_RE.fullmatch(val) and not ord(val[0]) & 0x40
+
+
+def _is_record_key(val):
+    return val not in ('.', '..') and RKEY_RE.fullmatch(val)
+
+
+def _is_uri(val):
+    return len(val) < 8 * 1024 and URI_RE.fullmatch(val)
+
+
+def _is_language(val):
+    return LANG_RE.fullmatch(val)
+
+
+# maps ATProto string format to function that takes a non-empty str value and
+# returns truthy if it's valid for that format, falsy otherwise.
+# https://atproto.com/specs/lexicon#string-formats
+STRING_FORMATS = {
+    'at-identifier': _is_at_identifier,
+    'at-uri': _is_at_uri,
+    'cid': _is_cid,
+    'datetime': _is_datetime,
+    'did': _is_did,
+    'handle': _is_handle,
+    'language': _is_language,
+    'nsid': _is_nsid,
+    'record-key': _is_record_key,
+    'tid': _is_tid,
+    'uri': _is_uri,
+}
+
+
 class Base():
     """Base class for both XRPC client and server."""
 
     defs = None  # dict mapping id to lexicon def
     _validate = None
     _truncate = None
+    # dict mapping key to compiled validator function. keys are either
+    # (NSID, type) for a method or record's schema, where type is input,
+    # output, message, parameters, or record, or (def id, via) for a def,
+    # where via is ref, union, unknown, or None. the second elements never
+    # overlap, so both kinds of keys can share this dict.
+    _validators = None
+    _object_validators = None  # dict mapping (nsid, type) to validate function
+    _param_decoders = None  # dict mapping method NSID to dict of param decoders
+    _compile_lock = None  # threading.RLock, held while compiling lexicon defs
+    _compiling = None  # dict mapping (id, via) to placeholder validator function
 
     def __init__(self, lexicons=None, validate=True, truncate=False):
         """Constructor.
@@ -159,7 +363,8 @@ class Base():
         Args:
           lexicons (sequence of dict): lexicons, optional. If not provided,
             defaults to the official, built in ``com.atproto`` and ``app.bsky``
-            lexicons.
+            lexicons. These are used as is, not copied, so don't modify them
+            afterward.
           validate (bool): whether to validate schemas, parameters, and input
             and output bodies
           truncate (bool): whether to truncate string values that are longer
@@ -171,11 +376,24 @@ class Base():
         self._validate = validate
         self._truncate = truncate
         self.defs = {}
+        self._init_caches()
 
+        global _bundled_defs, _bundled_lexicons
         if lexicons is None:
+            if _bundled_defs:
+                self.defs = dict(_bundled_defs)
+                return
+
+            if _bundled_lexicons is None:
+                _bundled_lexicons = load_lexicons(files('lexrpc').joinpath('lexicons'))
+                logger.info('%d lexicons loaded', len(_bundled_lexicons))
             lexicons = _bundled_lexicons
 
-        for i, lexicon in enumerate(copy.deepcopy(lexicons)):
+        # the bundled defs are shared with every later instance, so always
+        # check them, regardless of this instance's validate
+        check = validate or lexicons is _bundled_lexicons
+
+        for i, lexicon in enumerate(lexicons):
             nsid = lexicon.get('id')
             if not nsid or not isinstance(nsid, str):
                 raise ValidationError(f'Lexicon {i} missing or invalid id field')
@@ -188,25 +406,53 @@ class Base():
                 self.defs[id] = defn
 
                 type = defn['type']
-                if type not in LEXICON_TYPES | PARAMETER_TYPES:
+                if type not in DEF_TYPES:
                     raise ValidationError(f'Bad type for lexicon {id}: {type}')
 
-                if validate:
+                if check:
                     for field in ('input', 'output', 'message', 'parameters',
                                   'record'):
-                        if schema := defn.get('field'):
+                        if schema := defn.get(field):
                             if not isinstance(schema, dict):
                                 raise ValidationError(f'{nsid} {field} is invalid')
-                            elif not isinstance(schema.get('properties'), dict):
+                            if field in ('input', 'output', 'message'):
+                                schema = schema.get('schema') or {}
+                                if not isinstance(schema, dict):
+                                    raise ValidationError(f'{nsid} {field} schema is invalid')
+                            # properties is optional, eg for refs and unions
+                            props = schema.get('properties')
+                            if props is not None and not isinstance(props, dict):
                                 raise ValidationError(f'{nsid} {field} properties is invalid')
 
-                self.defs[id] = defn
-
         self.defs['blob'] = BLOB_DEF
 
         if not self.defs:
             logger.error('No lexicons loaded!')
 
+        if lexicons is _bundled_lexicons:
+            _bundled_defs = dict(self.defs)
+
+    def _init_caches(self):
+        """Creates empty compiled validator caches and the compile lock."""
+        self._validators = {}
+        self._object_validators = {}
+        self._param_decoders = {}
+        self._compile_lock = threading.RLock()
+        self._compiling = {}
+
+    def __getstate__(self):
+        """Omits the compile lock and compiled caches, which can't be pickled."""
+        state = self.__dict__.copy()
+        for attr in ('_validators', '_object_validators', '_param_decoders',
+                     '_compile_lock', '_compiling'):
+            state.pop(attr, None)
+        return state
+
+    def __setstate__(self, state):
+        """Restores state and starts with empty caches, recompiled on use."""
+        self.__dict__.update(state)
+        self._init_caches()
+
     def _get_def(self, id):
         """Returns the given lexicon def.
 
@@ -249,217 +495,552 @@ class Base():
         if not self._validate and not self._truncate:
             return obj
 
+        return self._object_validator(nsid, type)(obj)
+
+    def validate_many(self, nsid, type, objs):
+        """Validates multiple ATProto values against the same lexicon schema.
+
+        Like :meth:`validate`, but looks up the schema once for all of the
+        values, so it's faster for batches.
+
+        Args:
+          nsid (str): method NSID
+          type (str): ``input``, ``output``, ``parameters``, or ``record``
+          objs (iterable of dict): JSON objects
+
+        Returns:
+          list of dict: objs, each either unchanged, or possibly a modified
+            copy if ``truncate`` is enabled and a string value was too long
+
+        Raises:
+          NotImplementedError: if no lexicon exists for the given NSID, or the
+            lexicon does not define a schema for the given type
+          ValidationError: if any object is invalid
+        """
+        if not self._validate and not self._truncate:
+            return list(objs)
+
+        validate = self._object_validator(nsid, type)
+        return [validate(obj) for obj in objs]
+
+    def _object_validator(self, nsid, type):
+        """Returns a function that validates objects against a schema.
+
+        Builds the function on first use and caches the result.
+
+        Args:
+          nsid (str): method NSID
+          type (str): ``input``, ``output``, ``message``, ``parameters``, or
+            ``record``
+
+        Returns:
+          callable: ``(obj) => obj``, see :meth:`validate`
+
+        Raises:
+          NotImplementedError: if no lexicon exists for the given NSID
+        """
+        key = (nsid, type)
+        validate = self._object_validators.get(key)
+        if not validate:
+            validate = self._object_validators[key] = \
+                self._build_object_validator(nsid, type)
+        return validate
+
+    def _build_object_validator(self, nsid, type):
+        """Looks up a schema and returns a function that validates against it.
+
+        Handles truncation too, if enabled.
+
+        Args:
+          nsid (str): method NSID
+          type (str): ``input``, ``output``, ``message``, ``parameters``, or
+            ``record``
+
+        Returns:
+          callable: ``(obj) => obj``, see :meth:`validate`
+
+        Raises:
+          NotImplementedError: if no lexicon exists for the given NSID
+        """
         assert type in ('input', 'output', 'message', 'parameters', 'record'), type
 
         base = self._get_def(nsid).get(type, {})
         encoding = base.get('encoding')
         if encoding and encoding != 'application/json':
             # binary or other non-JSON data, pass through
-            return obj
+            return lambda obj: obj
 
         schema = base
         if type in ('input', 'output', 'message'):
             schema = base.get('schema')
 
         if not schema:
-            return obj
+            return lambda obj: obj
             # ...or should we fail if obj is non-null? maybe not, since then
             # we'd fail if a query with no params gets requested with any query
             # params at all, eg utm_* tracking params
 
+        truncate = []
         if self._truncate:
             for name, config in schema.get('properties', {}).items():
                 # TODO: recurse into reference, union, etc properties
                 if max_graphemes := config.get('maxGraphemes'):
-                    val = obj.get(name)
-                    if val and grapheme.length(val) > max_graphemes:
-                        obj = {
-                            **obj,
-                            name: grapheme.slice(val, end=max_graphemes - 1) + '…',
-                        }
+                    truncate.append((name, max_graphemes))
+
+        validator = self._validator(nsid, type, schema) if self._validate else None
+
+        def validate(obj):
+            # copy obj at most once, on the first property that needs truncating
+            truncated = None
+            for name, max_graphemes in truncate:
+                val = obj.get(name)
+                if (isinstance(val, str) and len(val) > max_graphemes
+                        and grapheme_length(val) > max_graphemes):
+                    if truncated is None:
+                        truncated = dict(obj)
+                    truncated[name] = grapheme_slice(val, max_graphemes - 1) + '…'
+
+            if truncated is not None:
+                obj = truncated
+
+            if validator:
+                validator(type, obj)
 
-        if self._validate:
-            self._validate_schema(name=type, val=obj, type_=nsid, lexicon=nsid,
-                                  schema=schema)
+            return obj
+
+        return validate
+
+    def _validator(self, nsid, type, schema):
+        """Returns the compiled validator for a method or record's schema.
+
+        Compiles the schema on first use and caches the result.
+
+        Args:
+          nsid (str): method NSID
+          type (str): ``input``, ``output``, ``message``, ``parameters``, or
+            ``record``
+          schema (dict): the schema for ``type`` in ``nsid``'s lexicon
+
+        Returns:
+          callable: see :meth:`_compile_schema`
+        """
+        key = (nsid, type)
+        validator = self._validators.get(key)
+        if not validator:
+            validator = self._validators[key] = self._compile_schema(
+                type_=nsid, lexicon=nsid, schema=schema)
+        return validator
 
-        return obj
+    def _def_validator(self, id, via=None):
+        """Returns the compiled validator for a lexicon def.
 
-    def _validate_schema(self, *, name, val, type_, lexicon, schema):
-        """Validates an ATProto value against a lexicon schema.
+        Compiles the def on first use and caches the result.
 
-        Returns ``None`` if the value validates, otherwise raises an exception.
+        Args:
+          id (str): fully qualified lexicon def id, eg ``app.bsky.feed.post``
+            or ``app.bsky.feed.post#replyRef``
+          via (str): ``ref``, ``union``, or ``unknown`` if the def is being
+            resolved from one of those types, ``None`` if it's a property's
+            ``ref``
+
+        Returns:
+          callable: see :meth:`_compile_schema`
+
+        Raises:
+          NotImplementedError: if no def exists for the given id
+        """
+        key = (id, via)
+        if validator := self._validators.get(key):
+            return validator
+
+        # servers may validate on multiple threads at once. only one compiles at
+        # a time, so that other threads never see the placeholder below.
+        with self._compile_lock:
+            if validator := (self._validators.get(key)
+                             or self._compiling.get(key)):
+                return validator
+
+            schema = self._get_def(id)
+            if schema.get('type') == 'record':
+                schema = schema.get('record')
+            if not schema:
+                raise ValidationError(f'lexicon {id} not found')
+            elif not via and not schema.get('type'):
+                raise ValidationError(f'lexicon {id} has missing or invalid type')
+
+            # placeholder for recursive refs back to this def while we compile
+            # it. looks up the compiled validator when it's called, or retries
+            # compiling if that failed.
+            self._compiling[key] = \
+                lambda name, val: self._def_validator(id, via=via)(name, val)
+            try:
+                validator = self._validators[key] = self._compile_schema(
+                    type_=via or schema['type'], lexicon=id, schema=schema,
+                    resolved=bool(via))
+            finally:
+                del self._compiling[key]
+
+        return validator
+
+    def _ref_validator(self, id, via=None):
+        """Returns the compiled validator for a ``ref`` target.
+
+        Resolves and compiles the target now, if it exists, so that validation
+        calls it directly instead of looking it up every time. If it doesn't
+        exist, defers that until validation, so that we only fail if a value
+        actually uses it.
+
+        Args:
+          id (str): fully qualified lexicon def id
+          via (str): see :meth:`_def_validator`
+
+        Returns:
+          callable: see :meth:`_compile_schema`
+        """
+        if id in self.defs:
+            return self._def_validator(id, via=via)
+
+        def validate(name, val):
+            self._def_validator(id, via=via)(name, val)
+        return validate
+
+    def _compile_schema(self, *, type_, lexicon, schema, resolved=False,
+                        name=None):
+        """Compiles a lexicon schema into a validator function.
+
+        Reads everything the validator needs out of the schema once, up front,
+        so that validating a value doesn't have to walk the schema dict again.
+        Only the checks that the schema actually uses are included, so eg a
+        plain ``integer`` property compiles down to a single type check.
+        ``ref`` targets are resolved and compiled here too, so validators call
+        each other directly. ``union`` and ``unknown`` targets depend on the
+        value's ``$type``, so they're compiled lazily, on first use, via
+        :meth:`_def_validator`.
+
+        The returned function takes two positional args, ``name`` (str, field
+        name) and ``val`` (the value to validate). It returns ``None`` if the
+        value validates, otherwise raises an exception.
 
         https://atproto.com/specs/lexicon
 
         Args:
-          name (str): field name
-          val: value
           type_ (str): name of type, eg ``integer`` or ``app.bsky.feed.post#replyRef``
           lexicon (str): fully qualified lexicon name that contains this schema,
             eg ``app.bsky.feed.post`` or ``app.bsky.feed.post#replyRef``
           schema (dict): schema to validate against if this is a compound
             object and not a primitive
+          resolved (bool): whether this schema is the target of a ``ref``,
+            ``union``, or ``unknown`` that has already been resolved. If so,
+            the checks that ran against the original schema are skipped.
+          name (str): property name, if this schema is a property's. Only used
+            in error messages.
+
+        Returns:
+          callable: validator, ``(name, val) => None``. Raises
+          :class:`ValidationError` if the value is invalid.
 
         Raises:
-          ValidationError: if the value is invalid
+          ValidationError: if the schema itself is missing a required field,
+            eg an ``array`` without ``items``
         """
-        # logger.debug(f'@ {name} {type_} {lexicon} {str(val)[:100]} {str(schema)[:100]}')
+        prefix = f'in {lexicon}, ' if lexicon != type_ else ''
 
-        def get_schema(lex_name):
-            """Returns (fully qualified lexicon name, lexicon) tuple."""
-            schema_name = urljoin(lexicon, lex_name)
-            schema = self._get_def(schema_name)
-            if schema.get('type') == 'record':
-                schema = schema.get('record')
-            if not schema:
-                fail(f'lexicon {schema_name} not found')
-            return schema_name, schema
+        def invalid_schema(field):
+            where = f'property {name}' if name else f'{type_} schema'
+            raise ValidationError(
+                f'{lexicon} {where} has missing or invalid {field}')
 
-        def fail(msg):
+        def fail(name, val, msg):
             val_str = repr(val)
             if len(val_str) > 50:
                 val_str = val_str[:50] + '…'
-            prefix = f'in {lexicon}, ' if lexicon != type_ else ''
             raise ValidationError(
                 f'{prefix}{type_} {name} with value `{val_str}`: {msg}')
 
-        if const := schema.get('const'):
-            if val != const:
-                fail(f'is not const value {const}')
+        checks = []
+
+        if not resolved:
+            if const := schema.get('const'):
+                def check_const(name, val):
+                    if val != const:
+                        fail(name, val, f'is not const value {const}')
+                checks.append(check_const)
+
+            if enums := schema.get('enum'):
+                enums = frozenset(enums)
+
+                def check_enum(name, val):
+                    try:
+                        found = val in enums
+                    except TypeError:  # unhashable, eg dict or list
+                        found = False
+                    if not found:
+                        fail(name, val, 'is not one of enum values')
+                checks.append(check_enum)
+
+            if type_ == 'unknown':
+                validators = {}  # maps $type to compiled validator
+
+                def check_unknown(name, val):
+                    if isinstance(val, dict) and (inner_type := val.get('$type')):
+                        validator = validators.get(inner_type)
+                        if not validator:
+                            validator = validators[inner_type] = self._def_validator(
+                                urljoin(lexicon, inner_type), via='unknown')
+                        validator(name, val)
+
+                checks.append(check_unknown)
+                return self._combine_checks(checks)
+
+            if expected := FIELD_TYPES.get(type_):
+                def check_type(name, val):
+                    if type(val) is not expected:
+                        fail(name, val, f'has unexpected type {type(val).__name__}')
+                checks.append(check_type)
+
+            if type_ in ('array', 'bytes', 'string'):
+                min_length = schema.get('minLength')
+                max_length = schema.get('maxLength')
+                if min_length or max_length:
+                    is_string = type_ == 'string'
+                    def check_length(name, val):
+                        # string lengths are UTF-8 bytes, 1-4 per char. ASCII
+                        # is one byte per char, and other strings only need to
+                        # be encoded if their char count doesn't settle it.
+                        length = len(val)
+                        if is_string and not val.isascii() and (
+                                (max_length and length * 4 > max_length)
+                                or (min_length and length < min_length)):
+                            length = len(val.encode('utf-8'))
+                        if max_length and length > max_length:
+                            fail(name, val, f'is longer ({length}) than maxLength {max_length}')
+                        elif min_length and length < min_length:
+                            fail(name, val, f'is shorter ({length}) than minLength {min_length}')
+                    checks.append(check_length)
+
+            if type_ == 'string':
+                if format := schema.get('format'):
+                    if is_valid := STRING_FORMATS.get(format):
+                        def check_format(name, val):
+                            if not val or not is_valid(val):
+                                fail(name, val, f'{val} is invalid for format {format}')
+                    else:
+                        def check_format(name, val):
+                            try:
+                                self._validate_string_format(val, format)
+                            except ValidationError as e:
+                                fail(name, val, e.args[0])
+                    checks.append(check_format)
+
+                min_graphemes = schema.get('minGraphemes')
+                max_graphemes = schema.get('maxGraphemes')
+                if min_graphemes or max_graphemes:
+                    def check_graphemes(name, val):
+                        # each grapheme is at least one char, so strings with
+                        # no more chars than max_graphemes can skip segmentation
+                        if (max_graphemes and not min_graphemes
+                                and len(val) <= max_graphemes):
+                            return
+                        length = grapheme_length(val)
+                        if min_graphemes and length < min_graphemes:
+                            fail(name, val, f'is shorter than minGraphemes {min_graphemes}')
+                        if max_graphemes and length > max_graphemes:
+                            fail(name, val, f'is longer than maxGraphemes {max_graphemes}')
+                    checks.append(check_graphemes)
+
+        if not resolved or type_ == 'unknown':
+            if minimum := schema.get('minimum'):
+                def check_minimum(name, val):
+                    if val < minimum:
+                        fail(name, val, f'is lower than minimum {minimum}')
+                checks.append(check_minimum)
+
+            if maximum := schema.get('maximum'):
+                def check_maximum(name, val):
+                    if val > maximum:
+                        fail(name, val, f'is higher than maximum {maximum}')
+                checks.append(check_maximum)
+
+            if schema.get('type') == 'token':
+                def check_token(name, val):
+                    if val != lexicon:
+                        fail(name, val, f'is not token {lexicon}')
+                    elif val not in self.defs:
+                        fail(name, val, f'not found')
+                checks.append(check_token)
+
+        if not resolved:
+            # ref and union hand off to their resolved schema, so they're last
+            if type_ == 'ref':
+                ref = schema.get('ref')
+                if not ref or not isinstance(ref, str):
+                    invalid_schema('ref')
+                ref_validator = self._ref_validator(urljoin(lexicon, ref), via='ref')
+                def check_ref(name, val):
+                    if isinstance(val, str) and val != ref:
+                        fail(name, val, f'is not {ref}')
+                    elif not isinstance(val, dict):
+                        fail(name, val, 'is not object')
+                    ref_validator(name, val)
+                checks.append(check_ref)
+                return self._combine_checks(checks)
+
+            if type_ == 'union':
+                refs = ref_set = None
+                if schema.get('closed'):
+                    if not isinstance(schema.get('refs'), list):
+                        invalid_schema('refs')
+                    refs = [urljoin(lexicon, ref) for ref in schema['refs']]
+                    ref_set = frozenset(refs)
+
+                # maps $type to compiled validator. only holds types that
+                # exist, so it's bounded by the number of defs.
+                validators = {}
+
+                def check_union(name, val):
+                    if isinstance(val, dict):
+                        inner_type = val.get('$type')
+                        if not inner_type:
+                            fail(name, val, 'missing $type')
+                    elif isinstance(val, str):
+                        inner_type = val
+                    else:
+                        fail(name, val, 'is invalid')
+
+                    if ref_set:
+                        try:
+                            found = inner_type in ref_set
+                        except TypeError:  # unhashable, eg dict or list
+                            found = False
+                        if not found:
+                            fail(name, val, f"{inner_type} isn't one of {refs}")
+
+                    validator = validators.get(inner_type)
+                    if not validator:
+                        try:
+                            validator = validators[inner_type] = self._def_validator(
+                                urljoin(lexicon, inner_type), via='union')
+                        except NotImplementedError:
+                            # https://github.com/bluesky-social/atproto/discussions/2940
+                            # https://github.com/snarfed/lexrpc/issues/16
+                            logger.debug('Skipping unknown type %s', inner_type)
+                            return
+
+                    validator(name, val)
+
+                checks.append(check_union)
+                return self._combine_checks(checks)
+
+            # TODO: maybe bring back once we figure out why the AppView isn't
+            # currently enforcing these:
+            # https://github.com/snarfed/bridgy-fed/issues/1348#issuecomment-2381056468
+            # if type_ == 'blob':
+            #     if max_size := schema.get('maxSize'):
+            #         # old-style blobs don't have size
+            #         # https://atproto.com/specs/data-model#blob-type
+            #         if size := val.get('size'):
+            #             if size > max_size:
+            #                 fail(name, val, f'has size {val["size"]} over maxSize {max_size}')
+            #     self.validate_mime_type(val['mimeType'], schema.get('accept'), name=name)
+
+            if type_ == 'array':
+                items = schema.get('items')
+                if not isinstance(items, dict) or not items.get('type'):
+                    invalid_schema('items')
+                validate_item = self._compile_schema(
+                    type_=items['type'], lexicon=lexicon, schema=items,
+                    name=name)
+                def check_items(name, val):
+                    for item in val:
+                        validate_item(name, item)
+                checks.append(check_items)
 
-        if enums := schema.get('enum'):
-            if val not in enums:
-                fail('is not one of enum values')
+        props = schema.get('properties', {})
+        if props:
+            required = frozenset(schema.get('required', ()))
+            nullable = frozenset(schema.get('nullable', ()))
+
+            prop_validators = []
+            for prop_name, prop_schema in props.items():
+                # objects built in Python code usually have string literal
+                # keys, which are interned, so this lets dict lookups on them
+                # match by identity instead of comparing strings
+                prop_name = sys.intern(prop_name)
+                prop_type = (prop_schema.get('type')
+                             if isinstance(prop_schema, dict) else None)
+                if not prop_type:
+                    raise ValidationError(
+                        f'{lexicon} property {prop_name} has missing or invalid type')
+                elif prop_type == 'ref':
+                    ref = prop_schema.get('ref')
+                    if not ref or not isinstance(ref, str):
+                        raise ValidationError(
+                            f'{lexicon} property {prop_name} has missing or invalid ref')
+                    validate_prop = self._ref_validator(urljoin(lexicon, ref))
+                else:
+                    validate_prop = self._compile_schema(
+                        type_=prop_type, lexicon=lexicon, schema=prop_schema,
+                        name=prop_name)
+                prop_validators.append((
+                    prop_name,
+                    prop_name in required,
+                    prop_type == 'null' or prop_name in nullable,
+                    validate_prop,
+                ))
+
+            def check_props(name, val):
+                if not isinstance(val, dict):
+                    fail(name, val, 'should be object')
+
+                for (prop_name, is_required, is_nullable,
+                     validate_prop) in prop_validators:
+                    if prop_name not in val:
+                        if is_required:
+                            fail(name, val, f'missing required property {prop_name}')
+                        continue
+
+                    prop_val = val[prop_name]
+                    if prop_val is None:
+                        if not is_nullable:
+                            fail(name, val, f'property {prop_name} is not nullable')
+                        continue
+
+                    validate_prop(prop_name, prop_val)
+
+            checks.append(check_props)
 
-        if type_ == 'unknown':
-            if isinstance(val, dict) and val.get('$type'):
-                lexicon, schema = get_schema(val['$type'])
-                # pass through and validate with this schema
-            else:
-                return
+        # unknown parameters aren't allowed
+        if schema.get('type') == 'params':
+            def check_params(name, val):
+                if unknown := val.keys() - props.keys():
+                    fail(name, val, f'unknown parameters: {unknown}')
+            checks.append(check_params)
 
-        if expected := FIELD_TYPES.get(type_):
-            if type(val) != expected:
-                fail(f'has unexpected type {type(val).__name__}')
-
-        if type_ in ('array', 'bytes', 'string'):
-            min_length = schema.get('minLength')
-            max_length = schema.get('maxLength')
-            length = len(val.encode('utf-8') if type_ == 'string' else val)
-            if max_length and length > max_length:
-                fail(f'is longer ({length}) than maxLength {max_length}')
-            elif min_length and length < min_length:
-                fail(f'is shorter ({length}) than minLength {min_length}')
-
-        if type_ == 'string':
-            if format := schema.get('format'):
-                try:
-                    self._validate_string_format(val, format)
-                except ValidationError as e:
-                    fail(e.args[0])
-
-            min_graphemes = schema.get('minGraphemes')
-            max_graphemes = schema.get('maxGraphemes')
-            if min_graphemes or max_graphemes:
-                length = grapheme.length(val)
-                if min_graphemes and length < min_graphemes:
-                    fail(f'is shorter than minGraphemes {min_graphemes}')
-                if max_graphemes and length > max_graphemes:
-                    fail(f'is longer than maxGraphemes {max_graphemes}')
-
-        if minimum := schema.get('minimum'):
-            if val < minimum:
-                fail(f'is lower than minimum {minimum}')
-        if maximum := schema.get('maximum'):
-            if val > maximum:
-                fail(f'is higher than maximum {maximum}')
-
-        if schema and schema.get('type') == 'token':
-            if val != lexicon:
-                fail(f'is not token {lexicon}')
-            elif val not in self.defs:
-                fail(f'not found')
-
-        if type_ == 'ref':
-            ref = schema['ref']
-            if isinstance(val, str) and val != ref:
-                fail(f'is not {ref}')
-            elif not isinstance(val, dict):
-                fail('is not object')
-            lexicon, schema = get_schema(ref)
-
-        if type_ == 'union':
-            if isinstance(val, dict):
-                inner_type = val.get('$type')
-                if not inner_type:
-                    fail('missing $type')
-            elif isinstance(val, str):
-                inner_type = val
-            else:
-                fail("is invalid")
+        return self._combine_checks(checks)
 
-            if schema.get('closed'):
-                refs = [urljoin(lexicon, ref) for ref in schema['refs']]
-                if inner_type not in refs:
-                    fail(f"{inner_type} isn't one of {refs}")
+    @staticmethod
+    def _combine_checks(checks):
+        """Combines compiled check functions into a single validator.
 
-            try:
-                lexicon, schema = get_schema(inner_type)
-            except NotImplementedError:
-                # https://github.com/bluesky-social/atproto/discussions/2940
-                # https://github.com/snarfed/lexrpc/issues/16
-                logger.debug(f'Skipping unknown type {inner_type}')
-                return
+        Args:
+          checks (sequence of callable): each ``(name, val) => None``
+
+        Returns:
+          callable: ``(name, val) => None``, runs each check in order
+        """
+        if not checks:
+            # eg a resolved schema with no constraints left to check
+            return lambda name, val: None
+        elif len(checks) == 1:
+            return checks[0]
 
-        # TODO: maybe bring back once we figure out why the AppView isn't
-        # currently enforcing these:
-        # https://github.com/snarfed/bridgy-fed/issues/1348#issuecomment-2381056468
-        # if type_ == 'blob':
-        #     if max_size := schema.get('maxSize'):
-        #         # old-style blobs don't have size
-        #         # https://atproto.com/specs/data-model#blob-type
-        #         if size := val.get('size'):
-        #             if size > max_size:
-        #                 fail(f'has size {val["size"]} over maxSize {max_size}')
-        #     self.validate_mime_type(val['mimeType'], schema.get('accept'), name=name)
-
-        if type_ == 'array':
-            for item in val:
-                self._validate_schema(
-                    name=name, val=item, type_=schema['items']['type'],
-                    lexicon=lexicon, schema=schema['items'])
+        checks = tuple(checks)
 
-        props = schema.get('properties', {})
-        if props and not isinstance(val, dict):
-            fail('should be object')
-
-        required = schema.get('required', [])
-        nullable = schema.get('nullable', [])
-        for prop_name, prop_schema in props.items():
-            if prop_name not in val:
-                if prop_name in required:
-                    fail(f'missing required property {prop_name}')
-                continue
-
-            prop_type = prop_schema['type']
-            prop_lexicon = lexicon
-            prop_val = val[prop_name]
-            if prop_val is None:
-                if prop_type != 'null' and prop_name not in nullable:
-                    fail(f'property {prop_name} is not nullable')
-                continue
-
-            if prop_type == 'ref':
-                prop_lexicon, prop_schema = get_schema(prop_schema['ref'])
-                prop_type = prop_schema['type']
-
-            self._validate_schema(name=prop_name, val=prop_val, type_=prop_type,
-                                  lexicon=prop_lexicon, schema=prop_schema)
+        def validate(name, val):
+            for check in checks:
+                check(name, val)
 
-        # unknown parameters aren't allowed
-        if schema.get('type') == 'params':
-            if unknown := val.keys() - props.keys():
-                fail(f'unknown parameters: {unknown}')
+        return validate
 
     def _validate_string_format(self, val, format):
         """Validates an ATProto string value against a format.
@@ -473,77 +1054,10 @@ class Base():
         Raises:
           ValidationError: if the value is invalid for the given format
         """
-        def check(condition):
-            if not condition:
-                raise ValidationError(f'{val} is invalid for format {format}')
-
-        check(val)
-
-        # TODO: switch to match once we require Python 3.10+
-        if format == 'at-identifier':
-            check(DID_RE.match(val) or DOMAIN_RE.match(val.lower()))
-
-        elif format == 'at-uri':
-            check(len(val) < 8 * 1024)
-            check(AT_URI_RE.match(val))
-            check('/./' not in val
-                  and '/../' not in val
-                  and not val.endswith('/.')
-                  and not val.endswith('/..'))
-
-        elif format == 'cid':
-            # ideally I'd use CID.decode here, but it doesn't support CIDv5,
-            # it's too strict about padding, etc.
-            check(CID_RE.match(val))
-
-        elif format == 'datetime':
-            check('T' in val)
-
-            orig_val = val
-            # timezone is required
-            val = re.sub(r'([+-][0-9]{2}:[0-9]{2}|Z)$', '', orig_val)
-            check(val != orig_val)
-
-            # strip fractional seconds
-            val = re.sub(r'\.[0-9]+$', '', val)
-
-            try:
-                datetime.fromisoformat(val)
-            except ValueError:
-                check(False)
-
-        elif format == 'did':
-            check(DID_RE.match(val))
-
-        elif format == 'nsid':
-            check(len(val) <= 317)
-            check(NSID_RE.match(val) and '.' in val)
-
-        elif format in 'handle':
-            check(len(val) <= 253)
-            check(DOMAIN_RE.match(val.lower()))
-
-        elif format == 'tid':
-            check(TID_RE.match(val))
-            # high bit, big-endian, can't be 1
-            check(not ord(val[0]) & 0x40)
-
-        elif format == 'record-key':
-            check(val not in ('.', '..') and RKEY_RE.match(val))
-
-        elif format == 'uri':
-            check(len(val) < 8 * 1024)
-            check(' ' not in val)
-            parsed = urlparse(val)
-            check(parsed.scheme
-                  and parsed.scheme[0].lower() in string.ascii_lowercase
-                  and (parsed.netloc or parsed.path or parsed.query
-                       or parsed.fragment))
-
-        elif format == 'language':
-            check(LANG_RE.match(val))
-
-        else:
+        is_valid = STRING_FORMATS.get(format)
+        if not val or (is_valid and not is_valid(val)):
+            raise ValidationError(f'{val} is invalid for format {format}')
+        elif not is_valid:
             raise ValidationError(f'unknown format {format}')
 
     @staticmethod
@@ -580,14 +1094,14 @@ class Base():
           params (dict): maps str names to boolean, number, str, or list values
 
         Returns:
-          bytes: URL-encoded query parameter string
+          str: URL-encoded query parameter string
         """
-        return urlencode({
-            name: ('true' if val is True
+        return urlencode([
+            (name, 'true' if val is True
                    else 'false' if val is False
                    else val)
             for name, val in params.items()
-        }, doseq=True)
+        ], doseq=True)
 
     def decode_params(self, method_nsid, params):
         """Decodes encoded parameter values.
@@ -603,42 +1117,57 @@ class Base():
 
         Raises:
           ValueError: if a parameter value can't be decoded
+          ValidationError: if a parameter's lexicon type isn't allowed for
+            parameters
           NotImplementedError: if no method lexicon is registered for the given NSID
         """
-        lexicon = self._get_def(method_nsid)
-        params_schema = lexicon.get('parameters', {}).get('properties', {})
+        decoders = self._param_decoders.get(method_nsid)
+        if decoders is None:
+            decoders = self._build_param_decoders(method_nsid)
 
         decoded = {}
         for name, val in params:
-            type = params_schema.get(name, {}).get('type') or 'string'
-            assert type in PARAMETER_TYPES, type
-
-            if type == 'boolean':
-                if val == 'true':
-                    decoded[name] = True
-                elif val == 'false':
-                    decoded[name] = False
-                else:
-                    raise ValueError(
-                        f'Got {val!r} for boolean parameter {name}, expected true or false')
-
-            try:
-                if type == 'number':
-                    decoded[name] = float(val)
-                elif type in ('int', 'integer'):
-                    decoded[name] = int(val)
-            except ValueError as e:
-                e.args = [f'{e.args[0]} for {type} parameter {name}']
-                raise e
-
-            if type == 'string':
+            decoder = decoders.get(name)
+            if decoder is None:
                 decoded[name] = val
-
-            if type == 'array':
+            elif decoder is list:
                 decoded.setdefault(name, []).append(val)
+            else:
+                decoded[name] = decoder(name, val)
 
         return decoded
 
+    def _build_param_decoders(self, method_nsid):
+        """Builds and caches the parameter decoders for a method.
+
+        Args:
+          method_nsid (str):
+
+        Returns:
+          dict: maps str parameter name to :const:`PARAM_DECODERS` value.
+          Parameters that aren't in the method's lexicon are strings.
+
+        Raises:
+          NotImplementedError: if no method lexicon is registered for the given NSID
+        """
+        lexicon = self._get_def(method_nsid)
+        params_schema = lexicon.get('parameters', {}).get('properties', {})
+
+        decoders = {}
+        for name, schema in params_schema.items():
+            type = schema.get('type') or 'string'
+            if type in PARAM_DECODERS:
+                decoders[name] = PARAM_DECODERS[type]
+            else:
+                # only fail if this parameter is actually used
+                def unsupported(name, val, type=type):
+                    raise ValidationError(
+                        f'{method_nsid} parameter {name} has unsupported type {type}')
+                decoders[name] = unsupported
+
+        self._param_decoders[method_nsid] = decoders
+        return decoders
+
     @classmethod
     def loggable(cls, val):
         return (
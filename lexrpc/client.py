@@ -38,8 +38,7 @@ class _NsidClient():
 
     eg ``client.com.example.my_method(...)``
     """
-    client = None
-    nsid = None
+    __slots__ = ('client', 'nsid')
 
     def __init__(self, client, nsid):
         assert client and nsid
@@ -48,7 +47,7 @@ class _NsidClient():
 
     def __getattr__(self, attr):
         segment = attr.replace('_', '-')
-        if NSID_SEGMENT_RE.match(segment):
+        if NSID_SEGMENT_RE.fullmatch(segment):
             return _NsidClient(self.client, f'{self.nsid}.{segment}')
 
         return getattr(super(), attr)
@@ -110,7 +109,7 @@ class Client(Base):
         self.session_callback = session_callback
 
     def __getattr__(self, attr):
-        if NSID_SEGMENT_RE.match(attr):
+        if NSID_SEGMENT_RE.fullmatch(attr):
             return _NsidClient(self, attr)
 
         return getattr(super(), attr)
@@ -183,7 +182,9 @@ class Client(Base):
         if isinstance(input, IOBase) or hasattr(input, 'read'):
             input = input.read()
 
-        logger.debug(f'requests.{fn} {url} {params_str} {self.loggable(input)}')
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug('requests.%s %s %s %s', fn, url, params_str,
+                         self.loggable(input))
         resp = fn(
           url,
           json=input if input and isinstance(input, dict) else None,
@@ -197,13 +198,15 @@ class Client(Base):
             output = resp.json()
 
         if not resp.ok:
-            logger.debug(f'Got {resp.status_code}: {resp.text}')
+            if logger.isEnabledFor(logging.DEBUG):
+                # resp.text decodes the whole body, so only do it if we'll log it
+                logger.debug('Got %s: %s', resp.status_code, resp.text)
 
         if nsid in (LOGIN_NSID, REFRESH_NSID):  # auth
             if resp.ok:
-                logger.debug(f'Logged in as {output.get("did")}, storing session')
+                logger.debug('Logged in as %s, storing session', output.get('did'))
             else:
-                logger.debug(f'Login failed, nulling out session')
+                logger.debug('Login failed, nulling out session')
                 output = {}
 
             self.session = output
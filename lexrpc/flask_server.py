@@ -42,7 +42,7 @@ def init_flask(xrpc_server, app):
       xrpc_server (lexrpc.Server)
       app (flask.Flask)
     """
-    logger.info(f'Registering {xrpc_server} with {app}')
+    logger.info('Registering %s with %s', xrpc_server, app)
 
     sock = Sock(app)
     for nsid, _ in xrpc_server._methods.items():
@@ -66,7 +66,7 @@ class XrpcEndpoint(View):
         self.server = server
 
     def dispatch_request(self, nsid):
-        if not NSID_RE.match(nsid):
+        if not NSID_RE.fullmatch(nsid):
             return {
                 'error': 'InvalidRequest',
                 'message': f'{nsid} is not a valid NSID',
@@ -92,7 +92,7 @@ class XrpcEndpoint(View):
         else:
             # binary
             if request.content_type != in_encoding:
-                logger.warning(f'expecting input encoding {in_encoding}, request has Content-Type {request.content_type} !')
+                logger.warning('expecting input encoding %s, request has Content-Type %s !', in_encoding, request.content_type)
             input = request.get_data()
 
         # run method
@@ -110,7 +110,7 @@ class XrpcEndpoint(View):
             }, 501, RESPONSE_HEADERS
         except (ValidationError, ValueError) as e:
             if isinstance(e, ValueError):
-                logging.debug(f'Method raised', exc_info=True)
+                logging.debug('Method raised', exc_info=True)
             return {
                 'error': getattr(e, 'name', 'InvalidRequest'),
                 'message': getattr(e, 'message', str(e)),
@@ -154,7 +154,7 @@ def subscription(xrpc_server, nsid):
                                timeout=SUBSCRIPTION_ITERATOR_TIMEOUT.total_seconds())
         for result in iter:
             if not ws.connected:
-                logger.debug(f'Websocket client disconnected from {nsid}')
+                logger.debug('Websocket client disconnected from %s', nsid)
                 iter.interrupt()
                 return
             elif result == iter.get_sentinel():
@@ -163,23 +163,26 @@ def subscription(xrpc_server, nsid):
             header, payload = result
             # TODO: validate header, payload?
 
-            # log
-            seq = payload.get('seq')
-            did = payload.get('did') or payload.get('repo')
-            commit = payload.get('commit')
-            if isinstance(commit, CID):
-                commit = f'commit {commit.encode("base32")}'
-            # can't DAG-JSON encode payload here? maybe? it hits
-            # ValueError: Failed to encode DAG-CBOR. Unknown cbor tag `0`
-            # https://console.cloud.google.com/errors/detail/CNzlgrvr2bHuvwE;time=PT1H;refresh=true;locations=global?project=bridgy-federated
-            # eg dag_json.encode(payload, dialect="atproto")[:500]
-            logger.debug(f'Sending {nsid.split(".")[-1]} {seq} {did} {header.get("t")}')
+            # log. this runs for every event, so skip it entirely unless
+            # debug logging is on
+            if logger.isEnabledFor(logging.DEBUG):
+                seq = payload.get('seq')
+                did = payload.get('did') or payload.get('repo')
+                commit = payload.get('commit')
+                if isinstance(commit, CID):
+                    commit = f'commit {commit.encode("base32")}'
+                # can't DAG-JSON encode payload here? maybe? it hits
+                # ValueError: Failed to encode DAG-CBOR. Unknown cbor tag `0`
+                # https://console.cloud.google.com/errors/detail/CNzlgrvr2bHuvwE;time=PT1H;refresh=true;locations=global?project=bridgy-federated
+                # eg dag_json.encode(payload, dialect="atproto")[:500]
+                logger.debug('Sending %s %s %s %s', nsid.split('.')[-1], seq, did,
+                             header.get('t'))
 
             # emit!
             try:
                 ws.send(dag_cbor.encode(header) + dag_cbor.encode(payload))
             except (ConnectionError, ConnectionClosed, OSError) as err:
-                logger.debug(f'Websocket client disconnected from {nsid}: {err}')
+                logger.debug('Websocket client disconnected from %s: %s', nsid, err)
                 iter.interrupt()
                 return
 
@@ -194,10 +197,10 @@ def subscription(xrpc_server, nsid):
 
         for client in subscribers[nsid]:
             if client.ip == ip:
-                logger.debug(f'Rejecting connection, already connected for {nsid}: {ip} {request.user_agent}')
+                logger.debug('Rejecting connection, already connected for %s: %s %s', nsid, ip, request.user_agent)
                 raise TooManyRequests()
 
-        logger.debug(f'New websocket client for {nsid}: {ip} {request.user_agent}')
+        logger.debug('New websocket client for %s: %s %s', nsid, ip, request.user_agent)
         subscriber = Subscriber(ip=ip,
                                 user_agent=str(request.user_agent),
                                 args=request.args.to_dict(),
@@ -64,7 +64,7 @@ class Server(Base):
           nsid (str)
           fn (callable)
         """
-        assert NSID_RE.match(nsid)
+        assert NSID_RE.fullmatch(nsid)
 
         existing = self._methods.get(nsid)
         if existing:
@@ -91,7 +91,8 @@ class Server(Base):
           ValidationError: if the parameters, input, or returned output don't
             validate against the method's schemas
         """
-        logger.debug(f'{nsid}: {params} {self.loggable(input)}')
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug('%s: %s %s', nsid, params, self.loggable(input))
 
         fn = self._methods.get(nsid)
         if not fn:
@@ -108,10 +109,13 @@ class Server(Base):
 
         if subscription:
             def validator():
+                validate = (self._object_validator(nsid, 'message')
+                            if self._validate or self._truncate
+                            else lambda payload: payload)
                 for header, payload in output:
-                    payload = self.validate(nsid, 'message', payload)
-                    yield header, payload
+                    yield header, validate(payload)
             return validator()
         else:
-            logger.debug(f'Returning {self.loggable(output)}')
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug('Returning %s', self.loggable(output))
             return self.validate(nsid, 'output', output)
@@ -1,9 +1,12 @@
 """Unit tests for base.py."""
+import copy
 from datetime import datetime
 from unittest import skip, TestCase
+from unittest.mock import patch
 
 from .lexicons import LEXICONS
-from ..base import Base, ValidationError
+from .. import base as base_module
+from ..base import Base, grapheme_length, grapheme_slice, ValidationError
 
 # set as the base.now return value in mocks in tests
 NOW = datetime(2022, 2, 3)
@@ -51,6 +54,288 @@ class BaseTest(TestCase):
                     base.validate('io.example.stringLength', 'record',
                                   {'string': input}))
 
+    def test_validate_truncate_copies_only_when_needed(self):
+        base = Base(LEXICONS, truncate=True)
+
+        obj = {'string': 'short'}
+        self.assertIs(obj, base.validate('io.example.stringLength', 'record', obj))
+
+        obj = {'string': 'too many graphemes'}
+        got = base.validate('io.example.stringLength', 'record', obj)
+        self.assertEqual({'string': 'too many …'}, got)
+        self.assertEqual({'string': 'too many graphemes'}, obj)
+
+    @patch.object(base_module, '_bundled_defs', None)
+    @patch.object(base_module, '_bundled_lexicons', None)
+    def test_bundled_lexicons_loaded_lazily(self):
+        Base(LEXICONS)
+        self.assertIsNone(base_module._bundled_lexicons)
+
+        self.assertIn('com.atproto.server.getSession', Base().defs)
+        bundled = base_module._bundled_lexicons
+        self.assertTrue(bundled)
+
+        Base()
+        self.assertIs(bundled, base_module._bundled_lexicons)
+
+    def test_invalid_lexicon_fields(self):
+        for defn in (
+            {'type': 'record', 'record': 'foo'},
+            {'type': 'record', 'record': {'type': 'object', 'properties': 3}},
+            {'type': 'query', 'parameters': {'type': 'params', 'properties': []}},
+            {'type': 'procedure', 'input': {'encoding': 'application/json',
+                                            'schema': 'foo'}},
+            {'type': 'query', 'output': {'encoding': 'application/json',
+                                         'schema': {'type': 'object',
+                                                    'properties': 'foo'}}},
+        ):
+            with self.subTest(defn=defn), self.assertRaises(ValidationError):
+                Base([{'lexicon': 1, 'id': 'io.example.bad', 'defs': {'main': defn}}])
+
+        # shouldn't raise
+        Base([{'lexicon': 1, 'id': 'io.example.bad', 'defs': {'main': defn}}],
+             validate=False)
+
+    def test_invalid_property_schemas(self):
+        for prop, msg in (
+            ({'type': 'array'}, 'property foo has missing or invalid items'),
+            ({'type': 'array', 'items': {}},
+             'property foo has missing or invalid items'),
+            ({'type': 'array', 'items': {'type': 'array'}},
+             'property foo has missing or invalid items'),
+            ({}, 'property foo has missing or invalid type'),
+            ('foo', 'property foo has missing or invalid type'),
+            ({'type': 'ref'}, 'property foo has missing or invalid ref'),
+            ({'type': 'union', 'refs': 'x', 'closed': True},
+             'property foo has missing or invalid refs'),
+        ):
+            with self.subTest(prop=prop):
+                base = Base([{
+                    'lexicon': 1,
+                    'id': 'io.example.bad',
+                    'defs': {'main': {
+                        'type': 'record',
+                        'record': {'type': 'object', 'properties': {'foo': prop}},
+                    }},
+                }])
+                with self.assertRaises(ValidationError) as e:
+                    base.validate('io.example.bad', 'record', {})
+                self.assertEqual(f'io.example.bad {msg}', str(e.exception))
+
+    @patch.object(base_module, '_bundled_defs', None)
+    @patch.object(base_module, '_bundled_lexicons', None)
+    def test_bundled_defs_shared(self):
+        first = Base()
+        second = Base(validate=False)
+        self.assertEqual(first.defs, second.defs)
+        self.assertIsNot(first.defs, second.defs)
+        self.assertIs(first.defs['app.bsky.feed.post'],
+                      second.defs['app.bsky.feed.post'])
+
+        # shouldn't affect other instances
+        second.defs['io.example.foo'] = {}
+        self.assertNotIn('io.example.foo', Base().defs)
+
+    @patch.object(base_module, '_bundled_defs', None)
+    @patch.object(base_module, '_bundled_lexicons', [{
+        'lexicon': 1,
+        'id': 'io.example.bad',
+        'defs': {'main': {'type': 'record', 'record': 'foo'}},
+    }])
+    def test_bundled_defs_checked_even_without_validate(self):
+        with self.assertRaises(ValidationError):
+            Base(validate=False)
+        self.assertIsNone(base_module._bundled_defs)
+
+    def test_validate_compiles_schema_once(self):
+        record = {'baz': 3, 'biff': {'baj': 'foo'}}
+        self.base.validate('io.example.record', 'record', record)
+        key = ('io.example.record', 'record')
+        validator = self.base._validators[key]
+        object_validator = self.base._object_validators[key]
+
+        self.base.validate('io.example.record', 'record', record)
+        self.assertIs(validator, self.base._validators[key])
+        self.assertIs(object_validator, self.base._object_validators[key])
+
+    def test_validate_recursive_ref(self):
+        base = Base([{
+            'lexicon': 1,
+            'id': 'io.example.tree',
+            'defs': {
+                'main': {
+                    'type': 'record',
+                    'record': {
+                        'type': 'object',
+                        'properties': {
+                            'node': {'type': 'ref', 'ref': '#node'},
+                        },
+                    },
+                },
+                'node': {
+                    'type': 'object',
+                    'required': ['val'],
+                    'properties': {
+                        'val': {'type': 'integer'},
+                        'child': {'type': 'ref', 'ref': '#node'},
+                    },
+                },
+            },
+        }])
+
+        base.validate('io.example.tree', 'record', {
+            'node': {'val': 1, 'child': {'val': 2, 'child': {'val': 3}}},
+        })
+
+        with self.assertRaises(ValidationError):
+            base.validate('io.example.tree', 'record', {
+                'node': {'val': 1, 'child': {'val': 2, 'child': {'val': 'x'}}},
+            })
+
+    def test_grapheme_length(self):
+        for val, expected in (
+            ('', 0),
+            ('abc', 3),
+            ('a\r\nb', 3),
+            ('a\n\rb', 4),
+            ('café', 4),
+            ('🇨🇾🇬🇭', 2),
+        ):
+            with self.subTest(val=val):
+                self.assertEqual(expected, grapheme_length(val))
+
+    def test_grapheme_slice(self):
+        self.assertEqual('', grapheme_slice('', 3))
+        self.assertEqual('abc', grapheme_slice('abcdef', 3))
+        self.assertEqual('ab', grapheme_slice('ab', 3))
+        self.assertEqual('a\r\nb', grapheme_slice('a\r\nbcd', 3))
+        self.assertEqual('é🇨🇾x', grapheme_slice('é🇨🇾xyz', 3))
+
+    def test_validate_max_graphemes(self):
+        self.base.validate('io.example.stringLength', 'record',
+                           {'string': 'é' * 10})
+
+        for val in 'x' * 11, 'é' * 11:
+            with self.subTest(val=val), self.assertRaises(ValidationError):
+                self.base.validate('io.example.stringLength', 'record',
+                                   {'string': val})
+
+    def test_validate_max_length_utf8_bytes(self):
+        # 5 and 6 graphemes, 15 and 18 UTF-8 bytes. the first can skip encoding
+        for val in 'ü' * 10, '€' * 5, '€' * 6:
+            with self.subTest(val=val):
+                self.base.validate('io.example.stringLength', 'record',
+                                   {'string': val})
+
+        # 7 graphemes, 21 UTF-8 bytes
+        with self.assertRaises(ValidationError):
+            self.base.validate('io.example.stringLength', 'record',
+                               {'string': '€' * 7})
+
+    def test_validate_string_format_errors(self):
+        with self.assertRaises(ValidationError) as e:
+            self.base._validate_string_format('1985-13-12T23:20:50.123Z', 'datetime')
+        self.assertEqual('1985-13-12T23:20:50.123Z is invalid for format datetime',
+                         str(e.exception))
+
+        for format in 'handle', 'hand', 'foo':
+            with self.assertRaises(ValidationError):
+                self.base._validate_string_format('', format)
+
+        for format in 'hand', 'foo':
+            with self.assertRaises(ValidationError) as e:
+                self.base._validate_string_format('foo.com', format)
+            self.assertEqual(f'unknown format {format}', str(e.exception))
+
+    def test_validate_string_format_trailing_newline(self):
+        for val, format in (
+            ('at://did:plc:foo/a.b.c/123', 'at-uri'),
+            ('foo.com', 'at-identifier'),
+            ('bafyreigh2akiscaildc', 'cid'),
+            ('did:plc:foo', 'did'),
+            ('foo.com', 'handle'),
+            ('en-US', 'language'),
+            ('abc', 'record-key'),
+            ('3jzfcijpj2z2a', 'tid'),
+        ):
+            with self.subTest(format=format):
+                self.base._validate_string_format(val, format)
+                with self.assertRaises(ValidationError):
+                    self.base._validate_string_format(val + '\n', format)
+
+    def test_validate_string_format_datetime_not_rfc_3339(self):
+        # these are all valid ISO 8601, and datetime.fromisoformat accepts them
+        # in Python 3.11+, but they're not valid ATProto datetimes
+        for val in (
+            '1985-04-12T23:20Z',
+            '1985-04-12T23:20:50,123Z',
+            '19850412T232050Z',
+            '1985-W15-5T23:20:50Z',
+            '1985-04-12T23:20:50.123+00:00Z',
+            '1985-04-12T23:20:50Z\n',
+        ):
+            with self.subTest(val=val), self.assertRaises(ValidationError):
+                self.base._validate_string_format(val, 'datetime')
+
+    def test_validate_string_format_uri(self):
+        for val in 'file:///', 'http:#frag', 'dns:example.com', 'a+b.c-d:e':
+            with self.subTest(val=val):
+                self.base._validate_string_format(val, 'uri')
+
+        for val in ('http:', 'http://', 'http:?', 'http:#', 'http://?#',
+                    '1http://x', 'ht_tp://x', 'http://x\ty', 'http://x\n'):
+            with self.subTest(val=val), self.assertRaises(ValidationError):
+                self.base._validate_string_format(val, 'uri')
+
+    def test_validate_string_format_nsid_trailing_newline(self):
+        self.base._validate_string_format('io.example.foo', 'nsid')
+
+        with self.assertRaises(ValidationError):
+            self.base._validate_string_format('io.example.foo\n', 'nsid')
+
+    def test_validate_doesnt_modify_lexicons(self):
+        lexicons = copy.deepcopy(LEXICONS)
+        base = Base(lexicons, truncate=True)
+        base.validate('io.example.kitchenSink', 'record', {
+            'array': ['x', 'y'],
+            'boolean': True,
+            'integer': 3,
+            'string': 'z',
+            'datetime': '1985-04-12T23:20:50Z',
+            'object': {
+                'array': ['x', 'y'],
+                'boolean': True,
+                'integer': 3,
+                'string': 'z',
+                'subobject': {'boolean': False},
+            },
+        })
+        base.validate('io.example.stringLength', 'record',
+                      {'string': 'too many graphemes'})
+        self.assertEqual(LEXICONS, lexicons)
+
+    def test_validate_enum(self):
+        base = Base([{
+            'lexicon': 1,
+            'id': 'io.example.enum',
+            'defs': {
+                'main': {
+                    'type': 'record',
+                    'record': {
+                        'type': 'object',
+                        'properties': {
+                            'x': {'type': 'string', 'enum': ['a', 'b']},
+                        },
+                    },
+                },
+            },
+        }])
+        base.validate('io.example.enum', 'record', {'x': 'b'})
+
+        for bad in 'c', ['a'], {'a': 'b'}:
+            with self.assertRaises(ValidationError):
+                base.validate('io.example.enum', 'record', {'x': bad})
+
     def test_validate_record_pass_nested_optional_field_missing(self):
         self.base.validate('io.example.record', 'record', {
             'baz': 3,
@@ -230,6 +515,25 @@ class BaseTest(TestCase):
             'foo': 'bar',
         }})
 
+    def test_validate_union_closed(self):
+        base = Base()
+        create = {
+            '$type': 'com.atproto.repo.applyWrites#create',
+            'collection': 'app.bsky.feed.post',
+            'value': {},
+        }
+        base.validate('com.atproto.repo.applyWrites', 'input', {
+            'repo': 'did:plc:foo',
+            'writes': [create],
+        })
+
+        for bad in 'app.bsky.feed.post', ['x'], {'$type': 'un.known'}:
+            with self.subTest(bad=bad), self.assertRaises(ValidationError):
+                base.validate('com.atproto.repo.applyWrites', 'input', {
+                    'repo': 'did:plc:foo',
+                    'writes': [{**create, '$type': bad}],
+                })
+
     def test_validate_record_union_array_fail_bad_type(self):
         for bad in [
                 123,
@@ -255,6 +559,23 @@ class BaseTest(TestCase):
                     }],
                 })
 
+    def test_validate_many(self):
+        base = Base(LEXICONS, truncate=True)
+        self.assertEqual(
+            [{'string': 'short'}, {'string': 'too many …'}],
+            base.validate_many('io.example.stringLength', 'record', [
+                {'string': 'short'},
+                {'string': 'too many graphemes'},
+            ]))
+
+        self.assertEqual([], base.validate_many('io.example.record', 'record', []))
+
+        with self.assertRaises(ValidationError):
+            base.validate_many('io.example.record', 'record', [
+                {'baz': 3, 'biff': {'baj': 'foo'}},
+                {'baz': 'not an integer'},
+            ])
+
     def test_no_validate_or_truncate(self):
         # shouldn't raise
         base = Base(LEXICONS, validate=False, truncate=False)
@@ -288,3 +609,80 @@ class BaseTest(TestCase):
                 },
             }],
         })
+
+    def test_decode_params(self):
+        base = Base([{
+            'lexicon': 1,
+            'id': 'io.example.decode',
+            'defs': {
+                'main': {
+                    'type': 'query',
+                    'parameters': {
+                        'type': 'params',
+                        'properties': {
+                            'b': {'type': 'boolean'},
+                            'i': {'type': 'integer'},
+                            'n': {'type': 'number'},
+                            's': {'type': 'string'},
+                            'a': {'type': 'array', 'items': {'type': 'string'}},
+                            'o': {'type': 'object'},
+                        },
+                    },
+                },
+            },
+        }])
+
+        self.assertEqual({
+            'b': False,
+            'i': 3,
+            'n': 4.5,
+            's': 'x',
+            'a': ['y', 'z'],
+            'other': '6',
+        }, base.decode_params('io.example.decode', [
+            ('b', 'false'), ('i', '3'), ('n', '4.5'), ('s', 'x'), ('a', 'y'),
+            ('a', 'z'), ('other', '6'),
+        ]))
+
+        for name, val in ('b', 'nope'), ('i', '4.5'), ('n', 'x'):
+            with self.assertRaises(ValueError):
+                base.decode_params('io.example.decode', [(name, val)])
+
+        with self.assertRaises(ValidationError) as e:
+            base.decode_params('io.example.decode', [('o', 'x')])
+        self.assertEqual(
+            'io.example.decode parameter o has unsupported type object',
+            str(e.exception))
+
+        with self.assertRaises(NotImplementedError):
+            base.decode_params('io.example.unknown', [])
+
+    def test_encode_params(self):
+        self.assertEqual(
+            'b=true&c=false&i=1&j=0&n=4.5&s=x&a=y&a=z',
+            self.base.encode_params({
+                'b': True,
+                'c': False,
+                'i': 1,
+                'j': 0,
+                'n': 4.5,
+                's': 'x',
+                'a': ['y', 'z'],
+            }))
+
+    def test_encode_params_quoting(self):
+        self.assertEqual(
+            'q=a+b%26c%3Dd&t=1&t=%C3%A9&f+o=%2F',
+            self.base.encode_params({
+                'q': 'a b&c=d',
+                't': (1, 'é'),
+                'e': [],
+                'f o': '/',
+            }))
+
+        # same as urlencode: other sized sequences expand too, bytes names
+        # are quoted as is
+        self.assertEqual('a=0&a=1&a=2&k=v', self.base.encode_params({
+            'a': range(3),
+            b'k': 'v',
+        }))
@@ -1,6 +1,8 @@
 """Unit tests for client.py."""
+import copy
 from io import BytesIO
 import json
+import pickle
 from unittest import TestCase
 from unittest.mock import call, patch
 import urllib.parse
@@ -226,6 +228,25 @@ class ClientTest(TestCase):
         with self.assertRaises(ValidationError):
             self.client.io.example.params({}, bar='c')
 
+    @patch('requests.post', return_value=response({'items': ['z']}))
+    def test_pickle_and_deepcopy(self, mock_post):
+        # compile some validators first
+        with self.assertRaises(ValidationError):
+            self.client.io.example.params({}, bar='c')
+
+        for client in (pickle.loads(pickle.dumps(self.client)),
+                       copy.deepcopy(self.client)):
+            self.assertEqual('http://ser.ver', client.address)
+            self.assertEqual({'foo': 'ey'}, client.headers)
+            self.assertEqual(self.client.defs, client.defs)
+            self.assertEqual({}, client._validators)
+            self.assertIsNot(self.client._compile_lock, client._compile_lock)
+
+            with self.assertRaises(ValidationError):
+                client.io.example.params({}, bar='c')
+            self.assertEqual({'items': ['z']},
+                             client.io.example.array({}, foo=['a', 'b']))
+
     @patch('requests.post', return_value=response({'items': ['z']}))
     def test_array(self, mock_post):
         self.assertEqual({'items': ['z']},
@@ -195,6 +195,11 @@ class ServerTest(TestCase):
             def foo(input, **params):
                 pass
 
+        with self.assertRaises(AssertionError):
+            @server.method('io.example.trailingNewline\n')
+            def foo_newline(input, **params):
+                pass
+
     def test_decorator_method_name_already_registered(self):
         with self.assertRaises(AssertionError):
             @server.method('io.example.query')